@@ -0,0 +1,269 @@
+"""Очередь задач для распределённой оптимизации (координатор + воркеры на разных машинах).
+
+Координатор держит очередь в памяти и раздаёт её по TCP через
+``multiprocessing.managers``; воркеры забирают задачи пачками под «аренду»
+(lease) и периодически продлевают её heartbeat-ами. Если воркер пропал и
+аренда истекла — задачи возвращаются в очередь и достаются другому воркеру.
+"""
+import hashlib, os, secrets, threading, time
+from collections import deque
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+
+import config
+
+# --- параметры очереди по умолчанию ---
+QUEUE_HOST = "127.0.0.1"
+QUEUE_PORT = 50_000
+AUTHKEY_ENV = "OPTIMIZE_AUTHKEY"  # сервер менеджера распаковывает (unpickle) всё, что шлют клиенты, — ключ обязателен
+LEASE_TIMEOUT = 120   # сек. без heartbeat, после которых задача уходит другому воркеру
+MAX_ATTEMPTS = 3      # сколько раз задачу можно выдать, прежде чем признать её упавшей
+
+# исходники, входящие в отпечаток вместе с CSV (пути относительно корня проекта)
+ROOT_DIR = Path(__file__).parent
+FINGERPRINT_SOURCES = ("config.py", "run_backtest.py", "strategies/ada_mfi.py", "indicators/mfi.py")
+
+
+def queue_authkey() -> bytes | None:
+    """Ключ из OPTIMIZE_AUTHKEY; фиксированного ключа по умолчанию нет даже для loopback."""
+    key = os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+def generate_authkey() -> bytes:
+    return secrets.token_hex(16).encode()
+
+
+def data_fingerprint(path=None) -> str:
+    """sha256 от CSV с историей и исходников, от которых зависит final_value.
+
+    Хэшируем config.py (окно дат, START_CASH, COMMISSION, дефолты стратегии), стратегию, индикатор
+    и run_backtest.py (параметры фида) целиком, а не отдельные значения — так не пропустим новую настройку.
+    """
+    path = path or config.DATA_FILE
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    for src in FINGERPRINT_SOURCES:
+        # \r\n -> \n: checkout на Windows не должен давать другой отпечаток
+        h.update(src.encode())
+        h.update((ROOT_DIR / src).read_bytes().replace(b"\r\n", b"\n"))
+    return h.hexdigest()
+
+
+class JobQueue:
+    """Потокобезопасная очередь задач с арендой; живёт в процессе координатора."""
+
+    def __init__(self, jobs: list[dict], fingerprint: str,
+                 lease_timeout: float = LEASE_TIMEOUT, max_attempts: int = MAX_ATTEMPTS, clock=time.monotonic):
+        self._jobs = list(jobs)
+        self._clock = clock
+        self._fingerprint = fingerprint
+        self._lease_timeout = lease_timeout
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._pending = deque(range(len(self._jobs)))
+        self._leases = {}     # job_id -> (worker, deadline)
+        self._attempts = {}   # job_id -> сколько раз выдавали
+        self._results = {}    # job_id -> final_value
+        self._failed = {}     # job_id -> текст ошибки
+        self._workers = {}    # worker -> время последнего обращения
+
+    # --- вызывается воркерами через прокси ---
+
+    def lease_timeout(self) -> float:
+        """Воркеры шлют heartbeat с частотой от этого значения."""
+        return self._lease_timeout
+
+    def lease(self, worker: str, n: int) -> list[dict]:
+        """Выдаёт до n задач воркеру: [{'id', 'params', 'fingerprint'}, ...]"""
+        with self._lock:
+            self._touch(worker)
+            self._expire()
+            batch = []
+            deadline = self._clock() + self._lease_timeout
+            while self._pending and len(batch) < n:
+                job_id = self._pending.popleft()
+                self._leases[job_id] = (worker, deadline)
+                self._attempts[job_id] = self._attempts.get(job_id, 0) + 1
+                batch.append(dict(id=job_id, params=self._jobs[job_id], fingerprint=self._fingerprint))
+            return batch
+
+    def heartbeat(self, worker: str, job_ids: list[int]) -> list[int]:
+        """Продлевает аренду; возвращает id задач, которые всё ещё за этим воркером.
+
+        Воркер шлёт heartbeat и без задач — так координатор знает, что он жив.
+        """
+        with self._lock:
+            self._touch(worker)
+            deadline = self._clock() + self._lease_timeout
+            alive = []
+            for job_id in job_ids:
+                lease = self._leases.get(job_id)
+                if lease and lease[0] == worker:
+                    self._leases[job_id] = (worker, deadline)
+                    alive.append(job_id)
+            return alive
+
+    def complete(self, worker: str, job_id: int, value: float) -> None:
+        """Сохраняет результат. Бэктест детерминирован, поэтому «опоздавший» результат тоже принимаем."""
+        with self._lock:
+            self._touch(worker)
+            if job_id in self._results:
+                return
+            self._results[job_id] = value
+            self._failed.pop(job_id, None)
+            self._leases.pop(job_id, None)
+            try:
+                self._pending.remove(job_id)
+            except ValueError:
+                pass
+
+    def fail(self, worker: str, job_id: int, error: str) -> None:
+        """Задача упала у воркера: вернуть в очередь или, после MAX_ATTEMPTS, пометить упавшей."""
+        with self._lock:
+            self._touch(worker)
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker:
+                return
+            del self._leases[job_id]
+            self._retry_or_fail(job_id, error)
+
+    def release(self, worker: str, job_ids: list[int]) -> None:
+        """Воркер отказывается от задач (например, у него другие данные) — без штрафа по попыткам."""
+        with self._lock:
+            for job_id in job_ids:
+                lease = self._leases.get(job_id)
+                if lease and lease[0] == worker:
+                    del self._leases[job_id]
+                    self._attempts[job_id] -= 1
+                    self._pending.appendleft(job_id)
+
+    def leave(self, worker: str) -> None:
+        """Воркер завершился и больше не обратится к очереди."""
+        with self._lock:
+            self._workers.pop(worker, None)
+
+    def done(self) -> bool:
+        with self._lock:
+            self._expire()
+            return len(self._results) + len(self._failed) == len(self._jobs)
+
+    def progress(self) -> tuple[int, int, int, int]:
+        """(готово, упало, в работе, всего)"""
+        with self._lock:
+            return len(self._results), len(self._failed), len(self._leases), len(self._jobs)
+
+    # --- вызывается самим координатором ---
+
+    def results(self) -> list[tuple[float, dict]]:
+        with self._lock:
+            return [(value, self._jobs[job_id]) for job_id, value in sorted(self._results.items())]
+
+    def failed(self) -> dict[int, str]:
+        with self._lock:
+            return dict(self._failed)
+
+    def active_workers(self) -> int:
+        """Сколько воркеров ещё не вызвали leave() и подавали признаки жизни в пределах lease_timeout."""
+        with self._lock:
+            now = self._clock()
+            for worker, seen in list(self._workers.items()):
+                if now - seen > self._lease_timeout:
+                    del self._workers[worker]
+            return len(self._workers)
+
+    def _touch(self, worker):
+        self._workers[worker] = self._clock()
+
+    def _expire(self):
+        now = self._clock()
+        for job_id, (worker, deadline) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[job_id]
+                self._retry_or_fail(job_id, f"lease expired (worker {worker})")
+
+    def _retry_or_fail(self, job_id, error):
+        if self._attempts.get(job_id, 0) >= self._max_attempts:
+            self._failed[job_id] = error
+        else:
+            self._pending.append(job_id)
+
+
+class QueueManager(BaseManager):
+    """TCP-доступ к JobQueue координатора."""
+
+
+QueueManager.register("get_queue")
+
+
+def serve_queue(queue: JobQueue, host: str, port: int, authkey: bytes):
+    """Поднимает сервер очереди в фоновом потоке текущего процесса; возвращает сервер."""
+
+    class _ServerManager(BaseManager):
+        pass
+
+    _ServerManager.register("get_queue", callable=lambda: queue)
+    server = _ServerManager(address=(host, port), authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def connect_queue(host: str, port: int, authkey: bytes, retry_for: float = 30.0):
+    """Подключается к координатору (ждём до retry_for сек., пока он поднимется); возвращает прокси очереди."""
+    deadline = time.monotonic() + retry_for
+    while True:
+        manager = QueueManager(address=(host, port), authkey=authkey)
+        try:
+            manager.connect()
+            return manager.get_queue()
+        except ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+
+def _self_check():
+    """Проверка логики аренды без сети и бэктестов: python job_queue.py"""
+    now = [0.0]
+    q = JobQueue([dict(a=i) for i in range(3)], "fp", lease_timeout=10, max_attempts=2, clock=lambda: now[0])
+    assert q.lease_timeout() == 10
+
+    # выдача пачкой и heartbeat только своих задач
+    a = q.lease("w1", 2)
+    assert [j["id"] for j in a] == [0, 1] and a[0]["fingerprint"] == "fp"
+    assert q.heartbeat("w2", [0]) == []
+    now[0] = 8
+    assert q.heartbeat("w1", [0]) == [0]
+
+    # у задачи 1 аренда истекла -> уходит другому воркеру; 0 продлена и остаётся за w1
+    now[0] = 12
+    assert [j["id"] for j in q.lease("w2", 5)] == [2, 1]
+    assert q.heartbeat("w1", [0, 1]) == [0]
+
+    # «опоздавший» результат w1 по задаче 1 принимается, повторный — игнорируется
+    q.complete("w1", 1, 101.0)
+    q.complete("w2", 1, 999.0)
+    q.complete("w1", 0, 100.0)
+
+    # release не тратит попытку; fail после max_attempts помечает задачу упавшей
+    q.release("w2", [2])
+    assert [j["id"] for j in q.lease("w2", 1)] == [2]
+    q.fail("w2", 2, "boom")
+    assert [j["id"] for j in q.lease("w2", 1)] == [2]
+    assert not q.done()
+    q.fail("w2", 2, "boom again")
+    assert q.done() and q.failed() == {2: "boom again"}
+    assert q.results() == [(100.0, dict(a=0)), (101.0, dict(a=1))]
+
+    # leave и пропавшие воркеры не держат координатор
+    assert q.active_workers() == 2
+    q.leave("w1")
+    now[0] = 30
+    assert q.active_workers() == 0
+    print("job_queue: OK")
+
+
+if __name__ == "__main__":
+    _self_check()
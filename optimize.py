@@ -1,13 +1,21 @@
-import itertools, multiprocessing, os
+import argparse, itertools, multiprocessing, os, socket, threading, time
 import backtrader as bt
 from datetime import datetime
+from queue import Empty, SimpleQueue
 import config
-from run_backtest import get_datafeed
+import job_queue
+from run_backtest import ensure_data, get_datafeed
 from strategies.ada_mfi import AdaMfiStrategy
 
 # --- сколько процессов использовать (None или 0 = все доступные) ---
 CPUS = 10
 
+# --- распределённый режим (coordinator / worker) ---
+WORKER_POLL = 5            # сек. между запросами воркера, когда свободных задач нет
+HEARTBEAT_FRACTION = 1 / 3  # heartbeat каждые lease_timeout * HEARTBEAT_FRACTION сек.
+LOCAL_WORKER_JOIN_TIMEOUT = 30  # сек. на завершение локальных воркеров, потом terminate()
+MIN_LEASE_TIMEOUT = 3       # сек.; меньше — аренда может истечь между heartbeat-ами из-за сетевых задержек
+
 # --- сетка параметров для grid-поиска ---
 param_grid = dict(
     tp_initial=[0.015, 0.02, 0.025],   # 1.5 – 2.5 %
@@ -37,16 +45,22 @@ def run_combo(params: dict) -> tuple[float, dict]:
     return cerebro.broker.getvalue(), params
 
 
-def main():
-    # формируем список всех комбинаций
+def _run_job(job: dict) -> tuple[int, float | None, str | None]:
+    """Обёртка над run_combo для воркера: ошибку возвращаем, а не бросаем, чтобы не терять всю пачку"""
+    try:
+        value, _ = run_combo(job["params"])
+        return job["id"], value, None
+    except Exception as exc:
+        return job["id"], None, f"{type(exc).__name__}: {exc}"
+
+
+def build_combos() -> list[dict]:
+    """Все комбинации из param_grid."""
     names = list(param_grid.keys())
-    combos = [dict(zip(names, vals)) for vals in itertools.product(*param_grid.values())]
-    use_cpus = CPUS or multiprocessing.cpu_count()
-    print(f"Комбинаций: {len(combos)} | Ядер: {use_cpus}")
+    return [dict(zip(names, vals)) for vals in itertools.product(*param_grid.values())]
 
-    with multiprocessing.Pool(processes=use_cpus) as pool:
-        results = pool.map(run_combo, combos)
 
+def print_best(results: list[tuple[float, dict]]):
     best_val, best_params = max(results, key=lambda x: x[0])
 
     print("\n=== ЛУЧШИЙ РЕЗУЛЬТАТ (train) ===")
@@ -56,8 +70,209 @@ def main():
         print(f"  {k} = {v}")
 
 
+def main():
+    combos = build_combos()
+    use_cpus = CPUS or multiprocessing.cpu_count()
+    print(f"Комбинаций: {len(combos)} | Ядер: {use_cpus}")
+
+    with multiprocessing.Pool(processes=use_cpus) as pool:
+        results = pool.map(run_combo, combos)
+
+    print_best(results)
+
+
+def coordinator(host: str, port: int, lease_timeout: float, local_workers: int = 0, processes: int = 0):
+    """Публикует все комбинации в очередь и ждёт, пока воркеры их посчитают."""
+    ensure_data()
+    combos = build_combos()
+    queue = job_queue.JobQueue(combos, job_queue.data_fingerprint(), lease_timeout=lease_timeout)
+
+    # без OPTIMIZE_AUTHKEY генерируем случайный ключ: 127.0.0.1 доступен всем пользователям машины
+    authkey = job_queue.queue_authkey()
+    if authkey is None:
+        authkey = job_queue.generate_authkey()
+        print(f"{job_queue.AUTHKEY_ENV} не задан, сгенерирован ключ: {authkey.decode()}")
+        print(f"Запускайте воркеры с {job_queue.AUTHKEY_ENV}={authkey.decode()}")
+
+    # локальные воркеры — для запуска на одной машине (и для проверки).
+    # Стартуем их до serve_queue: fork процесса, в котором уже есть потоки сервера, может зависнуть;
+    # connect_queue сам подождёт, пока сервер поднимется.
+    procs = [multiprocessing.Process(target=worker,
+                                     args=("127.0.0.1" if host == "0.0.0.0" else host, port, processes, 0, authkey))
+             for _ in range(local_workers)]
+    for p in procs:
+        p.start()
+
+    job_queue.serve_queue(queue, host, port, authkey)
+    print(f"Комбинаций: {len(combos)} | Очередь: {host}:{port}")
+
+    while not queue.done():
+        ok, failed, running, total = queue.progress()
+        print(f"\rГотово: {ok}/{total} | в работе: {running} | упало: {failed}", end="", flush=True)
+        time.sleep(1)
+    print()
+
+    # сервер гасим, только когда все воркеры отключились (leave) или пропали дольше lease_timeout
+    while (active := queue.active_workers()):
+        print(f"\rЖдём завершения воркеров: {active}", end="", flush=True)
+        time.sleep(1)
+    print()
+
+    deadline = time.monotonic() + LOCAL_WORKER_JOIN_TIMEOUT
+    for p in procs:
+        p.join(timeout=max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            print(f"Локальный воркер {p.pid} не завершился, останавливаю")
+            p.terminate()
+            p.join()
+
+    for job_id, error in queue.failed().items():
+        print(f"Комбинация #{job_id} не посчитана: {error}")
+    results = queue.results()
+    if not results:
+        raise SystemExit("Ни одна комбинация не посчитана")
+    print_best(results)
+
+
+def worker(host: str, port: int, processes: int = 0, batch_size: int = 0, authkey: bytes | None = None):
+    """Забирает задачи пачками у координатора, считает их на локальных ядрах и отдаёт результаты."""
+    authkey = authkey or job_queue.queue_authkey()
+    if authkey is None:
+        raise SystemExit(f"Для подключения к {host} задайте {job_queue.AUTHKEY_ENV} (ключ печатает координатор)")
+    ensure_data()
+    fingerprint = job_queue.data_fingerprint()
+    use_cpus = processes or CPUS or multiprocessing.cpu_count()
+    batch_size = batch_size or use_cpus
+    name = f"{socket.gethostname()}:{os.getpid()}"
+
+    # пул создаём до подключения и до потока heartbeat: fork после запуска потоков может зависнуть,
+    # а унаследованный прокси очереди открывал бы из каждого дочернего процесса своё соединение с координатором
+    with multiprocessing.Pool(processes=use_cpus) as pool:
+        queue = job_queue.connect_queue(host, port, authkey)
+
+        heartbeat_interval = queue.lease_timeout() * HEARTBEAT_FRACTION
+        held = set()  # id задач, аренду которых продлеваем
+        held_lock = threading.Lock()
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(heartbeat_interval):
+                with held_lock:
+                    ids = list(held)
+                try:
+                    alive = set(queue.heartbeat(name, ids))
+                except (EOFError, ConnectionError):
+                    return
+                except Exception as exc:
+                    print(f"[{name}] heartbeat остановлен, аренда больше не продлевается: {exc!r}")
+                    return
+                # аренда истекла или задачу уже посчитал другой воркер — больше её не продлеваем
+                with held_lock:
+                    lost = (set(ids) - alive) & held  # досчитанные за время запроса — не потеря
+                    held.difference_update(lost)
+                if lost:
+                    print(f"[{name}] потеряна аренда задач {sorted(lost)}")
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+
+        def leave():
+            # сначала гасим heartbeat, иначе он может «оживить» воркера в очереди уже после leave()
+            stop.set()
+            heartbeat_thread.join()
+            queue.leave(name)
+
+        print(f"[{name}] подключён к {host}:{port} | ядер: {use_cpus}")
+
+        finished = SimpleQueue()  # (job_id, value, error) из колбэков пула
+        inflight = set()          # id задач, которые сейчас считаются в пуле
+
+        try:
+            while True:
+                # держим занятыми все ядра: новые задачи берём, как только освобождается слот,
+                # а не после того, как досчитается вся пачка
+                free = use_cpus - len(inflight)
+                if free:
+                    batch = queue.lease(name, min(free, batch_size))
+                    if not batch and queue.done():
+                        break  # всё посчитано; незаконченные дубли в пуле больше не нужны
+
+                    if any(job["fingerprint"] != fingerprint for job in batch):
+                        queue.release(name, [job["id"] for job in batch])
+                        leave()
+                        raise SystemExit(f"[{name}] локальные данные {config.DATA_FILE} или файлы "
+                                         f"{', '.join(job_queue.FINGERPRINT_SOURCES)} отличаются от координатора — "
+                                         "синхронизируйте их и перезапустите воркер")
+
+                    with held_lock:
+                        held.update(job["id"] for job in batch)
+                    for job in batch:
+                        inflight.add(job["id"])
+                        pool.apply_async(_run_job, (job,), callback=finished.put,
+                                         error_callback=lambda exc, job_id=job["id"]: finished.put(
+                                             (job_id, None, f"{type(exc).__name__}: {exc}")))
+
+                if not inflight:
+                    time.sleep(WORKER_POLL)
+                    continue
+
+                # ждём хотя бы один результат; по таймауту снова пробуем взять задачи в свободные слоты
+                try:
+                    done = [finished.get(timeout=WORKER_POLL)]
+                except Empty:
+                    # все слоты могут быть заняты дублями уже посчитанных задач — тогда ждать их незачем
+                    if queue.done():
+                        break
+                    continue
+                while not finished.empty():
+                    done.append(finished.get())
+
+                for job_id, value, error in done:
+                    # из held убираем до complete(), чтобы heartbeat не принял сданную задачу за потерянную
+                    with held_lock:
+                        held.discard(job_id)
+                    inflight.discard(job_id)
+                    if error is None:
+                        queue.complete(name, job_id, value)
+                    else:
+                        queue.fail(name, job_id, error)
+            leave()
+        except (EOFError, ConnectionError):
+            print(f"[{name}] координатор недоступен, завершаюсь")
+        finally:
+            stop.set()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Грид-поиск параметров AdaMfiStrategy")
+    sub = parser.add_subparsers(dest="mode")
+
+    coord = sub.add_parser("coordinator", help="раздавать комбинации воркерам по сети")
+    coord.add_argument("--host", default=job_queue.QUEUE_HOST, help="адрес для прослушивания (0.0.0.0 — все интерфейсы)")
+    coord.add_argument("--port", type=int, default=job_queue.QUEUE_PORT)
+    coord.add_argument("--lease-timeout", type=float, default=job_queue.LEASE_TIMEOUT)
+    coord.add_argument("--local-workers", type=int, default=0, help="сколько воркеров запустить на этой же машине")
+    coord.add_argument("--processes", type=int, default=0, help="процессов на каждого локального воркера")
+
+    work = sub.add_parser("worker", help="считать комбинации, полученные от координатора")
+    work.add_argument("--host", default=job_queue.QUEUE_HOST, help="адрес координатора")
+    work.add_argument("--port", type=int, default=job_queue.QUEUE_PORT)
+    work.add_argument("--processes", type=int, default=0, help="по умолчанию CPUS")
+    work.add_argument("--batch-size", type=int, default=0, help="задач за один запрос (по умолчанию = processes)")
+    args = parser.parse_args()
+    if args.mode == "coordinator" and args.lease_timeout < MIN_LEASE_TIMEOUT:
+        parser.error(f"--lease-timeout должен быть не меньше {MIN_LEASE_TIMEOUT} сек.")
+    return args
+
+
 if __name__ == "__main__":
     # Windows requires 'spawn' start method; ensure it to avoid RuntimeError when optimize.py imported elsewhere
     if os.name == "nt":
         multiprocessing.set_start_method("spawn", force=True)
-    main() 
\ No newline at end of file
+    args = parse_args()
+    if args.mode == "coordinator":
+        coordinator(args.host, args.port, args.lease_timeout, args.local_workers, args.processes)
+    elif args.mode == "worker":
+        worker(args.host, args.port, args.processes, args.batch_size)
+    else:
+        main() 
\ No newline at end of file